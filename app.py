@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime
 import html
 import streamlit as st
@@ -32,10 +33,27 @@ def ts_now() -> str:
 def safe_html(text: str) -> str:
     return html.escape(text).replace("\n", "<br>")
 
-def get_bot_reply(history: list[dict], prompt: str) -> str:
+def message_html(m: dict) -> str:
+    if m["role"] == "user":
+        return f"""
+            <div class="chat-row right">
+              <div class="bubble user">{m["content_html"]}</div>
+              <div class="avatar">🧑</div>
+            </div>
+            <div class="timestamp right">{m["ts"]}</div>
+            """
+    return f"""
+            <div class="chat-row left">
+              <div class="avatar">🤖</div>
+              <div class="bubble bot">{m["content_html"]}</div>
+            </div>
+            <div class="timestamp">{m["ts"]}</div>
+            """
+
+def get_bot_reply(history: list[dict], prompt: str, on_token=None) -> str:
     if st.session_state.rag_chain and st.session_state.vectorstore_ready:
         try:
-            response = st.session_state.rag_chain.get_response(prompt)
+            response = asyncio.run(st.session_state.rag_chain.get_response(prompt, on_token=on_token))
             return response["answer"]
         except Exception as e:
             st.error(f"Error with RAG chain: {str(e)}")
@@ -43,17 +61,28 @@ def get_bot_reply(history: list[dict], prompt: str) -> str:
     else:
         return "Please upload documents first to enable AI-powered responses based on your content."
 
+@st.cache_resource
+def get_or_build_rag_system(_embedding_manager):
+    # Runs once per process, so reruns don't deserialize the FAISS index again
+    vectorstore_manager = get_vectorstore_manager(
+        _embedding_manager.embeddings,
+        _embedding_manager=_embedding_manager
+    )
+    
+    rag_chain = None
+    if vectorstore_manager.load_vectorstore(show_messages=False):
+        rag_chain = create_conversational_chain(vectorstore_manager.get_retriever())
+    
+    return vectorstore_manager, rag_chain
+
 def setup_rag_system():
     try:
         embedding_manager = get_embedding_manager()
-        embeddings = embedding_manager.embeddings
-        
-        vectorstore_manager = get_vectorstore_manager(embeddings)
+        vectorstore_manager, rag_chain = get_or_build_rag_system(embedding_manager)
         
-        if vectorstore_manager.load_vectorstore(show_messages=False):
+        if rag_chain and st.session_state.rag_chain is None:
             st.session_state.vectorstore_ready = True
-            retriever = vectorstore_manager.get_retriever()
-            st.session_state.rag_chain = create_conversational_chain(retriever)
+            st.session_state.rag_chain = rag_chain
             st.success("RAG system loaded from saved vector store!")
         
         return embedding_manager, vectorstore_manager
@@ -91,7 +120,10 @@ with st.sidebar:
                     vectorstore_manager.save_vectorstore()
                     
                     retriever = vectorstore_manager.get_retriever()
-                    st.session_state.rag_chain = create_conversational_chain(retriever)
+                    if st.session_state.rag_chain:
+                        st.session_state.rag_chain.swap_retriever(retriever)
+                    else:
+                        st.session_state.rag_chain = create_conversational_chain(retriever)
                     
                     st.success("Documents processed successfully!")
                     st.rerun()
@@ -149,37 +181,32 @@ st.markdown("""
 
 st.title("RagBot")
 
-for m in st.session_state.messages:
-    if m["role"] == "user":
-        st.markdown(
-            f"""
-            <div class="chat-row right">
-              <div class="bubble user">{safe_html(m["content"])}</div>
-              <div class="avatar">🧑</div>
-            </div>
-            <div class="timestamp right">{m["ts"]}</div>
-            """,
-            unsafe_allow_html=True
-        )
-    else:
-        st.markdown(
-            f"""
-            <div class="chat-row left">
-              <div class="avatar">🤖</div>
-              <div class="bubble bot">{safe_html(m["content"])}</div>
-            </div>
-            <div class="timestamp">{m["ts"]}</div>
-            """,
-            unsafe_allow_html=True
-        )
+# History is escaped once on append and drawn as a single element per rerun
+if st.session_state.messages:
+    st.markdown("".join(message_html(m) for m in st.session_state.messages), unsafe_allow_html=True)
 
 prompt = st.chat_input("Pass your prompt here!")
 if prompt:
-    st.session_state.messages.append({"role": "user", "content": prompt, "ts": ts_now()})
-
-    reply = get_bot_reply(st.session_state.messages[:-1], prompt)
+    user_message = {"role": "user", "content": prompt, "content_html": safe_html(prompt), "ts": ts_now()}
+    st.session_state.messages.append(user_message)
+    st.markdown(message_html(user_message), unsafe_allow_html=True)
+
+    # Render the reply in place as tokens arrive instead of rerunning once it completes
+    reply_placeholder = st.empty()
+    reply_ts = ts_now()
+    streamed_html = []
+
+    def on_token(token: str) -> None:
+        # Escaping is per character, so tokens can be escaped independently and joined
+        streamed_html.append(safe_html(token))
+        reply_placeholder.markdown(
+            message_html({"role": "assistant", "content_html": "".join(streamed_html), "ts": reply_ts}),
+            unsafe_allow_html=True
+        )
 
-    st.session_state.messages.append({"role": "assistant", "content": reply, "ts": ts_now()})
+    reply = get_bot_reply(st.session_state.messages[:-1], prompt, on_token=on_token)
 
-    st.rerun()
+    bot_message = {"role": "assistant", "content": reply, "content_html": safe_html(reply), "ts": reply_ts}
+    st.session_state.messages.append(bot_message)
+    reply_placeholder.markdown(message_html(bot_message), unsafe_allow_html=True)
 
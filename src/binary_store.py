@@ -0,0 +1,157 @@
+import os
+import pickle
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain.schema import Document
+
+from src.rerank import cosine_topk
+
+
+# Sign-binarized vectors searched by Hamming distance. Full vectors are kept as fp16
+# so the top k * rerank_factor Hamming hits can be re-scored exactly for recall.
+class BinaryFAISS(VectorStore):
+    
+    def __init__(
+        self,
+        embedding_function: Embeddings,
+        index: faiss.IndexBinary,
+        vectors: np.ndarray,
+        docstore: InMemoryDocstore,
+        index_to_docstore_id: Dict[int, str],
+        rerank_factor: int = 10
+    ):
+        self.embedding_function = embedding_function
+        self.index = index
+        self.vectors = vectors
+        self.docstore = docstore
+        self.index_to_docstore_id = index_to_docstore_id
+        self.rerank_factor = rerank_factor
+    
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+    
+    @staticmethod
+    def binarize(xb: np.ndarray) -> np.ndarray:
+        return np.packbits((xb > 0).astype(np.uint8), axis=-1)
+    
+    @classmethod
+    def from_vectors(
+        cls,
+        xb: np.ndarray,
+        documents: List[Document],
+        embedding: Embeddings,
+        **kwargs: Any
+    ) -> "BinaryFAISS":
+        store = cls(
+            embedding_function=embedding,
+            index=faiss.IndexBinaryFlat(xb.shape[1]),
+            vectors=np.empty((0, xb.shape[1]), dtype=np.float16),
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+            **kwargs
+        )
+        store.add_vectors(xb, documents)
+        return store
+    
+    def add_vectors(self, xb: np.ndarray, documents: List[Document]) -> List[str]:
+        start = len(self.index_to_docstore_id)
+        ids = [str(i) for i in range(start, start + len(documents))]
+        self.index.add(self.binarize(xb))
+        self.vectors = np.concatenate([self.vectors, xb.astype(np.float16)])
+        self.docstore.add(dict(zip(ids, documents)))
+        self.index_to_docstore_id.update({start + i: doc_id for i, doc_id in enumerate(ids)})
+        return ids
+    
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        xb = np.asarray(self.embedding_function.embed_documents(texts), dtype=np.float32)
+        return self.add_vectors(xb, documents)
+    
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any
+    ) -> "BinaryFAISS":
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        xb = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+        return cls.from_vectors(xb, documents, embedding, **kwargs)
+    
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        n_candidates = min(k * self.rerank_factor, self.index.ntotal)
+        if n_candidates == 0:
+            return []
+        
+        q = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        _, hits = self.index.search(self.binarize(q), n_candidates)
+        candidates = hits[0][hits[0] >= 0]
+        
+        # Exact cosine on the Hamming shortlist
+        order, scores = cosine_topk(q[0], self.vectors[candidates], k)
+        return [
+            (self.docstore.search(self.index_to_docstore_id[int(candidates[i])]), float(score))
+            for i, score in zip(order, scores)
+        ]
+    
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(
+            self.embedding_function.embed_query(query), k=k, **kwargs
+        )
+    
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+    
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+    
+    def _select_relevance_score_fn(self):
+        # Embeddings are normalized, inner product is already cosine similarity
+        return lambda score: score
+    
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        os.makedirs(folder_path, exist_ok=True)
+        path = os.path.join(folder_path, index_name)
+        faiss.write_index_binary(self.index, f"{path}.faiss")
+        np.save(f"{path}.npy", self.vectors)
+        with open(f"{path}.pkl", "wb") as f:
+            pickle.dump((self.docstore, self.index_to_docstore_id), f)
+    
+    @classmethod
+    def load_local(
+        cls,
+        folder_path: str,
+        embeddings: Embeddings,
+        index_name: str = "index",
+        mmap: bool = False,
+        **kwargs: Any
+    ) -> "BinaryFAISS":
+        path = os.path.join(folder_path, index_name)
+        if mmap:
+            index = faiss.read_index_binary(f"{path}.faiss", faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            vectors = np.load(f"{path}.npy", mmap_mode="r")
+        else:
+            index = faiss.read_index_binary(f"{path}.faiss")
+            vectors = np.load(f"{path}.npy")
+        with open(f"{path}.pkl", "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        return cls(embeddings, index, vectors, docstore, index_to_docstore_id, **kwargs)
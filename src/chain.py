@@ -1,17 +1,140 @@
 import os
-from typing import Dict, List, Any, Optional
+from collections import OrderedDict
+from typing import Callable, Dict, List, Any, Optional
 from langchain.chains import ConversationalRetrievalChain
+from langchain.retrievers.multi_query import MultiQueryRetriever
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain.memory import ConversationBufferWindowMemory
+from langchain.memory import ConversationTokenBufferMemory
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain.schema import BaseRetriever, BaseMessage
+from langchain_core.messages import get_buffer_string
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.vectorstores import VectorStoreRetriever
+from langchain.schema import BaseRetriever, BaseMessage, Document
 from langchain.prompts import PromptTemplate
+from langchain.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    BaseCallbackHandler,
+    CallbackManagerForRetrieverRun
+)
+from pydantic import PrivateAttr
 import streamlit as st
 from dotenv import load_dotenv
 
 load_dotenv()
 
+QA_TEMPLATE = """You are a helpful AI assistant that answers questions based on the provided context from uploaded documents. 
+
+Use the following pieces of context to answer the question at the end. If you don't know the answer based on the context, just say that you don't have enough information to answer the question. Don't try to make up an answer.
+
+Always be conversational and helpful. If the context provides relevant information, use it to give a comprehensive answer.
+
+Context:
+{context}
+
+Chat History:
+{chat_history}
+
+Question: {question}
+Answer:"""
+
+# Parsed once at import rather than on every chain construction
+QA_PROMPT = PromptTemplate(
+    template=QA_TEMPLATE,
+    input_variables=["context", "chat_history", "question"]
+)
+
+# Identical (context, chat_history, question) prompts skip the Gemini round-trip
+set_llm_cache(SQLiteCache(database_path=".llm_cache.db"))
+
+
+class CachedRetriever(BaseRetriever):
+    retriever: BaseRetriever
+    max_size: int = 256
+    
+    _cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+    
+    def _remember(self, key: str, documents: List[Document]) -> List[Document]:
+        self._cache[key] = documents
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return documents
+    
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        key = self._normalize(query)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        
+        documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self._remember(key, documents)
+    
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        key = self._normalize(query)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        
+        documents = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return self._remember(key, documents)
+
+
+class PrunedTokenBufferMemory(ConversationTokenBufferMemory):
+    
+    # BaseChatMemory.asave_context appends without pruning, so route async saves through save_context
+    async def asave_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        await run_in_executor(None, self.save_context, inputs, outputs)
+
+
+class StreamingChatGoogleGenerativeAI(ChatGoogleGenerativeAI):
+    _token_counts: Dict[str, int] = PrivateAttr(default_factory=dict)
+    
+    # LangChain only streams invoke() calls for its own tracers, so honour the streaming flag too
+    def _should_stream(self, *, async_api: bool, **kwargs: Any) -> bool:
+        if self.streaming and self.disable_streaming is not True:
+            return True
+        return super()._should_stream(async_api=async_api, **kwargs)
+    
+    def get_num_tokens(self, text: str) -> int:
+        # Retrieved chunks recur across turns and every count is an API round-trip
+        if text not in self._token_counts:
+            if len(self._token_counts) >= 4096:
+                self._token_counts.clear()
+            self._token_counts[text] = super().get_num_tokens(text)
+        return self._token_counts[text]
+    
+    def get_num_tokens_from_messages(self, messages: List[BaseMessage], tools: Optional[Any] = None) -> int:
+        # Each count is an API call, so count the whole buffer in one request rather than per message
+        return self.get_num_tokens(get_buffer_string(messages))
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    # Streamlit elements can only be updated from the script thread, not an executor
+    run_inline = True
+    
+    def __init__(self):
+        self.on_token: Optional[Callable[[str], None]] = None
+    
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self.on_token is not None:
+            self.on_token(token)
+
 
 class ConversationalRAGChain:
     def __init__(
@@ -19,73 +142,91 @@ class ConversationalRAGChain:
         retriever: BaseRetriever,
         model_name: str = "gemini-1.5-flash",
         temperature: float = 0.7,
-        memory_window: int = 10
+        memory_token_limit: int = 1500,
+        context_token_limit: int = 6000,
+        multi_query: bool = False
     ):
         self.retriever = retriever
         self.model_name = model_name
         self.temperature = temperature
-        self.memory_window = memory_window
+        self.memory_token_limit = memory_token_limit
+        self.context_token_limit = context_token_limit
+        self.multi_query = multi_query
+        
+        self.stream_handler = TokenStreamHandler()
+        # Only the answer model streams, so condensed follow-up questions never reach the UI
+        self.llm = self._create_llm(streaming=True, callbacks=[self.stream_handler])
+        self.condense_llm = self._create_llm()
+        
+        # Fixed prompt cost, whatever is left after history goes to retrieved documents
+        self.prompt_tokens = self.llm.get_num_tokens(QA_PROMPT.format(context="", chat_history="", question=""))
+        self.context_token_budget = context_token_limit - self.prompt_tokens - memory_token_limit
+        if self.context_token_budget <= 0:
+            raise ValueError("context_token_limit leaves no room for retrieved documents")
         
-        self.llm = self._create_llm()
         self.memory = self._create_memory()
         self.chain = self._create_chain()
     
-    def _create_llm(self) -> ChatGoogleGenerativeAI:
+    def _create_llm(
+        self,
+        streaming: bool = False,
+        callbacks: Optional[List[BaseCallbackHandler]] = None
+    ) -> StreamingChatGoogleGenerativeAI:
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
             raise ValueError("GOOGLE_API_KEY not found in environment variables")
         
-        return ChatGoogleGenerativeAI(
+        return StreamingChatGoogleGenerativeAI(
             model=self.model_name,
             temperature=self.temperature,
-            google_api_key=api_key
+            google_api_key=api_key,
+            streaming=streaming,
+            callbacks=callbacks
         )
     
-    def _create_memory(self) -> ConversationBufferWindowMemory:
-        # Using the current implementation but with proper message history
+    def _create_memory(self) -> PrunedTokenBufferMemory:
+        # Bounded by tokens rather than turns, so long answers can't inflate every later prompt
         chat_history = ChatMessageHistory()
-        return ConversationBufferWindowMemory(
-            k=self.memory_window,
+        return PrunedTokenBufferMemory(
+            llm=self.condense_llm,
+            max_token_limit=self.memory_token_limit,
             memory_key="chat_history",
             output_key="answer",
             return_messages=True,
             chat_memory=chat_history
         )
     
+    def _wrap_retriever(self, retriever: BaseRetriever) -> CachedRetriever:
+        if self.multi_query:
+            # Rephrasings are retrieved concurrently under ainvoke and de-duplicated
+            retriever = MultiQueryRetriever.from_llm(
+                retriever=retriever,
+                llm=self.condense_llm,
+                include_original=True
+            )
+        return CachedRetriever(retriever=retriever)
+    
     def _create_chain(self) -> ConversationalRetrievalChain:
-        custom_template = """You are a helpful AI assistant that answers questions based on the provided context from uploaded documents. 
-
-Use the following pieces of context to answer the question at the end. If you don't know the answer based on the context, just say that you don't have enough information to answer the question. Don't try to make up an answer.
-
-Always be conversational and helpful. If the context provides relevant information, use it to give a comprehensive answer.
-
-Context:
-{context}
-
-Chat History:
-{chat_history}
-
-Question: {question}
-Answer:"""
-        
         return ConversationalRetrievalChain.from_llm(
             llm=self.llm,
-            retriever=self.retriever,
+            condense_question_llm=self.condense_llm,
+            retriever=self._wrap_retriever(self.retriever),
             memory=self.memory,
             return_source_documents=True,
             verbose=True,
-            combine_docs_chain_kwargs={
-                "prompt": PromptTemplate(
-                    template=custom_template,
-                    input_variables=["context", "chat_history", "question"]
-                )
-            }
+            max_tokens_limit=self.context_token_budget,
+            combine_docs_chain_kwargs={"prompt": QA_PROMPT}
         )
     
-    def get_response(self, question: str) -> Dict[str, Any]:
+    async def get_response(
+        self,
+        question: str,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, Any]:
         try:
+            self.stream_handler.on_token = on_token
             with st.spinner("Thinking..."):
-                result = self.chain.invoke({"question": question})
+                result = await self.chain.ainvoke({"question": question})
             
             return {
                 "answer": result.get("answer", "I couldn't generate a response."),
@@ -98,6 +239,14 @@ Answer:"""
                 "answer": "I encountered an error while processing your question. Please try again.",
                 "source_documents": []
             }
+        
+        finally:
+            self.stream_handler.on_token = None
+    
+    def swap_retriever(self, retriever: BaseRetriever) -> None:
+        # Rebind in place so the LLM clients and memory survive a vector store change
+        self.retriever = retriever
+        self.chain.retriever = self._wrap_retriever(retriever)
     
     def clear_memory(self) -> None:
         self.memory.clear()
@@ -107,15 +256,21 @@ Answer:"""
         return str(self.memory.buffer)
 
 
+# Retrievers aren't hashable by value; key on identity so each vector store gets one chain
+@st.cache_resource(hash_funcs={VectorStoreRetriever: id})
 def create_conversational_chain(
     retriever: BaseRetriever,
     model_name: str = "gemini-1.5-flash",
     temperature: float = 0.7,
-    memory_window: int = 10
+    memory_token_limit: int = 1500,
+    context_token_limit: int = 6000,
+    multi_query: bool = False
 ) -> ConversationalRAGChain:
     return ConversationalRAGChain(
         retriever=retriever,
         model_name=model_name,
         temperature=temperature,
-        memory_window=memory_window
+        memory_token_limit=memory_token_limit,
+        context_token_limit=context_token_limit,
+        multi_query=multi_query
     )
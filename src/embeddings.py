@@ -1,31 +1,178 @@
-from langchain_huggingface import HuggingFaceEmbeddings
-from typing import List
+import os
+import hashlib
+import sqlite3
+from contextlib import closing
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings, HuggingFaceEndpointEmbeddings
+from typing import List, Optional
 import streamlit as st
+import numpy as np
+import torch
+
+EMBEDDING_BACKENDS = ("huggingface", "tei", "onnx-int8")
+
+# Stay under SQLite's bound-parameter limit when looking up cached hashes
+CACHE_LOOKUP_BATCH = 500
+
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class ONNXInt8Embeddings(Embeddings):
+    
+    def __init__(self, model_name: str, cache_dir: str = "models", batch_size: int = 64):
+        try:
+            import onnxruntime as ort
+            from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError("onnx-int8 backend requires `pip install optimum[onnxruntime]`") from e
+        
+        self.batch_size = batch_size
+        save_dir = os.path.join(cache_dir, f"{model_name.replace('/', '--')}-onnx-int8")
+        
+        if not os.path.exists(os.path.join(save_dir, "model_quantized.onnx")):
+            # Export once and dynamically quantize weights to int8 for VNNI dot products
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            quantizer = ORTQuantizer.from_pretrained(model)
+            quantizer.quantize(
+                save_dir=save_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=True)
+            )
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(save_dir)
+        
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            save_dir,
+            file_name="model_quantized.onnx",
+            provider="CPUExecutionProvider",
+            session_options=session_options
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(save_dir)
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=512,
+                return_tensors="np"
+            )
+            # BGE uses the [CLS] token as the sentence embedding
+            cls = self.model(**inputs).last_hidden_state[:, 0]
+            vectors.append(cls / np.linalg.norm(cls, axis=1, keepdims=True))
+        return np.vstack(vectors).tolist() if vectors else []
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
 
 
 class EmbeddingManager:
     
-    def __init__(self, model_name: str = "BAAI/bge-base-en-v1.5"):
+    def __init__(
+        self,
+        model_name: str = "BAAI/bge-base-en-v1.5",
+        backend: str = "huggingface",
+        device: Optional[str] = None,
+        endpoint_url: Optional[str] = None,
+        cache_path: str = os.path.join("vectorstore", "emb_cache.sqlite")
+    ):
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}")
+        
         self.model_name = model_name
+        self.backend = backend
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.endpoint_url = endpoint_url or os.getenv("TEI_ENDPOINT_URL")
+        self.cache_path = cache_path
         self._embeddings = None
     
+    def _create_huggingface_embeddings(self) -> HuggingFaceEmbeddings:
+        model_kwargs = {'device': self.device}
+        if self.device.startswith("cuda"):
+            # Half precision roughly doubles GPU throughput, BGE loses no meaningful recall
+            model_kwargs['model_kwargs'] = {'torch_dtype': torch.float16}
+        
+        return HuggingFaceEmbeddings(
+            model_name=self.model_name,
+            model_kwargs=model_kwargs,
+            encode_kwargs={
+                'normalize_embeddings': True,
+                'batch_size': 128 if self.device.startswith("cuda") else 64
+            }
+        )
+    
+    def _create_tei_embeddings(self) -> HuggingFaceEndpointEmbeddings:
+        if not self.endpoint_url:
+            raise ValueError("TEI backend requires endpoint_url or TEI_ENDPOINT_URL")
+        
+        # TEI normalizes BGE embeddings server-side by default
+        return HuggingFaceEndpointEmbeddings(model=self.endpoint_url)
+    
     @property
-    def embeddings(self) -> HuggingFaceEmbeddings:
+    def embeddings(self) -> Embeddings:
         if self._embeddings is None:
             try:
-                self._embeddings = HuggingFaceEmbeddings(
-                    model_name=self.model_name,
-                    model_kwargs={'device': 'cpu'},     
-                    encode_kwargs={'normalize_embeddings': True} 
-                )
-                st.success(f"Loaded embedding model: {self.model_name}")
+                if self.backend == "tei":
+                    self._embeddings = self._create_tei_embeddings()
+                    st.success(f"Using TEI embedding endpoint: {self.endpoint_url}")
+                elif self.backend == "onnx-int8":
+                    self._embeddings = ONNXInt8Embeddings(self.model_name)
+                    st.success(f"Loaded embedding model: {self.model_name} (onnx int8, cpu)")
+                else:
+                    self._embeddings = self._create_huggingface_embeddings()
+                    st.success(f"Loaded embedding model: {self.model_name} ({self.device})")
             except Exception as e:
                 st.error(f"Failed to load embedding model: {str(e)}")
                 raise e
         
         return self._embeddings
+    
+    def embed_documents_cached(self, texts: List[str]) -> np.ndarray:
+        hashes = [content_hash(text) for text in texts]
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        
+        with closing(sqlite3.connect(self.cache_path)) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(model TEXT, hash TEXT, vector BLOB, PRIMARY KEY (model, hash))"
+            )
+            
+            cached = {}
+            unique_hashes = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique_hashes), CACHE_LOOKUP_BATCH):
+                batch = unique_hashes[start:start + CACHE_LOOKUP_BATCH]
+                rows = conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [self.model_name, *batch]
+                )
+                cached.update({h: np.frombuffer(vector, dtype=np.float32) for h, vector in rows})
+            
+            # Keyed by hash so duplicate chunks within one upload are embedded once
+            misses = {h: text for h, text in zip(hashes, texts) if h not in cached}
+            if misses:
+                vectors = np.asarray(self.embeddings.embed_documents(list(misses.values())), dtype=np.float32)
+                computed = dict(zip(misses, vectors))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                    [(self.model_name, h, vector.tobytes()) for h, vector in computed.items()]
+                )
+                conn.commit()
+                cached.update(computed)
+        
+        if not hashes:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack([cached[h] for h in hashes])
 
 
 @st.cache_resource
-def get_embedding_manager(model_name: str = "BAAI/bge-base-en-v1.5") -> EmbeddingManager:
-    return EmbeddingManager(model_name=model_name)
+def get_embedding_manager(
+    model_name: str = "BAAI/bge-base-en-v1.5",
+    backend: str = "huggingface"
+) -> EmbeddingManager:
+    return EmbeddingManager(model_name=model_name, backend=backend)
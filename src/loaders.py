@@ -1,50 +1,107 @@
 import os
-import tempfile
-from typing import List, Union
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple, Union
+import pypdfium2
 from langchain.schema import Document
 import streamlit as st
 
+# Break points from coarsest to finest, same order RecursiveCharacterTextSplitter used
+_SEPARATORS = ("\n\n", "\n", " ")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class FastTextSplitter:
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+    
+    def split_text(self, text: str) -> List[str]:
+        chunks = []
+        start = 0
+        
+        while start < len(text):
+            end = min(start + self.chunk_size, len(text))
+            if end < len(text):
+                # Prefer the coarsest separator in the back half of the window, else hard-cut
+                lo = start + max(self.chunk_size // 2, self.chunk_overlap + 1)
+                for separator in _SEPARATORS:
+                    cut = text.rfind(separator, lo, end)
+                    if cut != -1:
+                        end = cut
+                        break
+            
+            chunk = text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+            if end >= len(text):
+                break
+            
+            # Begin the next chunk at the first word boundary inside the overlap window
+            boundary = _WHITESPACE_RE.search(text, end - self.chunk_overlap, end)
+            start = boundary.end() if boundary else end
+        
+        return chunks
+    
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        return [
+            Document(page_content=chunk, metadata=dict(doc.metadata))
+            for doc in documents
+            for chunk in self.split_text(doc.page_content)
+        ]
+
+
+def _extract_one(pair: Tuple[bytes, str]) -> Tuple[str, List[Document], Optional[str]]:
+    data, name = pair
+    try:
+        # pdfium parses straight from the uploaded bytes, no temp file needed
+        pdf = pypdfium2.PdfDocument(data)
+        try:
+            documents = []
+            for page_number in range(len(pdf)):
+                page = pdf[page_number]
+                textpage = page.get_textpage()
+                documents.append(Document(
+                    page_content=textpage.get_text_range(),
+                    metadata={"source": name, "page": page_number, "file_type": "pdf"}
+                ))
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+        
+        return name, documents, None
+        
+    except Exception as e:
+        return name, [], str(e)
+
 
 class DocumentLoader:
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
+        self.text_splitter = FastTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     
     def load_documents(self, uploaded_files) -> List[Document]:
         all_documents = []
         
-        for uploaded_file in uploaded_files:
-            try:
-                # Create temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                    tmp_file.write(uploaded_file.getvalue())
-                    tmp_file_path = tmp_file.name
-                
-                # Load PDF
-                loader = PyPDFLoader(tmp_file_path)
-                documents = loader.load()
-                
-                # Add metadata
-                for doc in documents:
-                    doc.metadata["source"] = uploaded_file.name
-                    doc.metadata["file_type"] = "pdf"
-                
-                all_documents.extend(documents)
-                
-                # Clean up temporary file
-                os.unlink(tmp_file_path)
-                
-            except Exception as e:
-                st.error(f"Error processing {uploaded_file.name}: {str(e)}")
+        # UploadedFile objects can't cross process boundaries, so hand workers raw bytes
+        pairs = [(uploaded_file.getvalue(), uploaded_file.name) for uploaded_file in uploaded_files]
+        
+        if len(pairs) > 1:
+            with ProcessPoolExecutor(max_workers=min(len(pairs), os.cpu_count() or 1)) as executor:
+                results = list(executor.map(_extract_one, pairs))
+        else:
+            results = [_extract_one(pair) for pair in pairs]
+        
+        for name, documents, error in results:
+            if error is not None:
+                st.error(f"Error processing {name}: {error}")
                 continue
+            all_documents.extend(documents)
         
         return all_documents
     
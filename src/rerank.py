@@ -0,0 +1,50 @@
+from typing import Tuple
+import numba
+import numpy as np
+
+# No nnan/ninf: the per-thread buffers are seeded with -inf and must compare correctly
+_FASTMATH = {"reassoc", "contract", "nsz", "arcp", "afn"}
+
+
+@numba.njit(parallel=True, fastmath=_FASTMATH, cache=True)
+def _cosine_topk(q, xb, k, n_blocks):
+    n, d = xb.shape
+    block = (n + n_blocks - 1) // n_blocks
+    top_scores = np.full((n_blocks, k), -np.inf, dtype=np.float32)
+    top_ids = np.full((n_blocks, k), -1, dtype=np.int64)
+    
+    for b in numba.prange(n_blocks):
+        for i in range(b * block, min(n, (b + 1) * block)):
+            score = np.float32(0.0)
+            for j in range(d):
+                score += q[j] * xb[i, j]
+            
+            # Each block keeps a sorted top-k buffer, k is small so insertion beats a heap
+            if score > top_scores[b, k - 1]:
+                pos = k - 1
+                while pos > 0 and top_scores[b, pos - 1] < score:
+                    top_scores[b, pos] = top_scores[b, pos - 1]
+                    top_ids[b, pos] = top_ids[b, pos - 1]
+                    pos -= 1
+                top_scores[b, pos] = score
+                top_ids[b, pos] = i
+    
+    flat_scores = top_scores.ravel()
+    flat_ids = top_ids.ravel()
+    order = np.argsort(-flat_scores)[:k]
+    return flat_ids[order], flat_scores[order]
+
+
+def cosine_topk(q: np.ndarray, xb: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Shape and dtype dispatch stays out of the jitted kernel so it compiles for one signature
+    q = np.ascontiguousarray(q, dtype=np.float32).reshape(-1)
+    xb = np.ascontiguousarray(xb, dtype=np.float32)
+    if xb.ndim == 1:
+        xb = xb.reshape(1, -1)
+    
+    k = min(k, xb.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    
+    n_blocks = max(1, min(numba.get_num_threads(), xb.shape[0] // k))
+    return _cosine_topk(q, xb, k, n_blocks)
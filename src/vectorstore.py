@@ -1,31 +1,149 @@
+import gc
 import os
-from typing import List, Optional
+from typing import List, Optional, Union
+import numpy as np
+import faiss
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.schema import Document
 from langchain_huggingface import HuggingFaceEmbeddings
 import streamlit as st
 import pickle
 
+from src.binary_store import BinaryFAISS
+from src.embeddings import EmbeddingManager
+
+# FAISS warns when k-means gets fewer than 39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+QUANTIZATION_MODES = ("pq", "fp16", "binary")
+
+# Documents embedded per embed_documents call, the model batches within each slab
+EMBED_SLAB_SIZE = 2048
+
 
 class VectorStoreManager:
     
-    def __init__(self, embeddings: HuggingFaceEmbeddings, persist_directory: str = "vectorstore"):
+    def __init__(
+        self,
+        embeddings: HuggingFaceEmbeddings,
+        persist_directory: str = "vectorstore",
+        nlist: int = 256,
+        M: int = 48,
+        nbits: int = 8,
+        nprobe: int = 16,
+        quantization: str = "pq",
+        mmap: bool = True,
+        embedding_manager: Optional[EmbeddingManager] = None
+    ):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATION_MODES}")
+        
         self.embeddings = embeddings
         self.persist_directory = persist_directory
-        self.vectorstore: Optional[FAISS] = None
+        self.nlist = nlist
+        self.M = M
+        self.nbits = nbits
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self.mmap = mmap
+        self.embedding_manager = embedding_manager
+        self.vectorstore: Optional[Union[FAISS, BinaryFAISS]] = None
+        # Name of the saved index currently mapped read-only, if any
+        self._mapped_name: Optional[str] = None
         
         os.makedirs(persist_directory, exist_ok=True)
     
-    def create_vectorstore(self, documents: List[Document]) -> FAISS:
+    def _index_description(self, num_vectors: int) -> str:
+        if self.quantization == "fp16":
+            if num_vectors < self.nlist * MIN_POINTS_PER_CENTROID:
+                return "SQfp16"
+            return f"IVF{self.nlist},SQfp16"
+        
+        min_training_points = max(self.nlist, 2 ** self.nbits) * MIN_POINTS_PER_CENTROID
+        if num_vectors < min_training_points:
+            # Too few vectors to train IVF/PQ codebooks, fp16 codes need no real training
+            return "SQfp16"
+        return f"IVF{self.nlist},PQ{self.M}x{self.nbits}"
+    
+    def _build_index(self, xb: np.ndarray) -> faiss.Index:
+        index = faiss.index_factory(
+            xb.shape[1],
+            self._index_description(xb.shape[0]),
+            faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(xb)
+        return index
+    
+    def _new_vectorstore(self, xb: np.ndarray) -> Union[FAISS, BinaryFAISS]:
+        if self.quantization == "binary":
+            return BinaryFAISS(
+                embedding_function=self.embeddings,
+                index=faiss.IndexBinaryFlat(xb.shape[1]),
+                vectors=np.empty((0, xb.shape[1]), dtype=np.float16),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={}
+            )
+        
+        # Embeddings are normalized, so inner product is cosine similarity
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=self._build_index(xb),
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
+    
+    def _set_nprobe(self) -> None:
+        if self.quantization == "binary":
+            return
+        
+        try:
+            faiss.extract_index_ivf(self.vectorstore.index).nprobe = self.nprobe
+        except RuntimeError:
+            # Not an IVF index, nothing to probe
+            pass
+    
+    def _add_vectors(self, xb: np.ndarray, documents: List[Document]) -> None:
+        if isinstance(self.vectorstore, BinaryFAISS):
+            self.vectorstore.add_vectors(xb, documents)
+            return
+        
+        start = len(self.vectorstore.index_to_docstore_id)
+        ids = [str(i) for i in range(start, start + len(documents))]
+        self.vectorstore.index.add(xb)
+        self.vectorstore.docstore.add(dict(zip(ids, documents)))
+        self.vectorstore.index_to_docstore_id.update(
+            {start + i: doc_id for i, doc_id in enumerate(ids)}
+        )
+    
+    def _embed_documents(self, documents: List[Document]) -> np.ndarray:
+        # One preallocated contiguous float32 buffer that FAISS can consume without copying
+        xb = None
+        for start in range(0, len(documents), EMBED_SLAB_SIZE):
+            texts = [doc.page_content for doc in documents[start:start + EMBED_SLAB_SIZE]]
+            if self.embedding_manager is not None:
+                vectors = self.embedding_manager.embed_documents_cached(texts)
+            else:
+                vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+            
+            if xb is None:
+                xb = np.empty((len(documents), vectors.shape[1]), dtype=np.float32)
+            xb[start:start + len(texts)] = vectors
+        return xb
+    
+    def create_vectorstore(self, documents: List[Document]) -> Union[FAISS, BinaryFAISS]:
         if not documents:
             raise ValueError("No documents provided to create vector store")
         
         try:
             with st.spinner("Creating vector store..."):
-                self.vectorstore = FAISS.from_documents(
-                    documents=documents,
-                    embedding=self.embeddings
-                )
+                xb = self._embed_documents(documents)
+                self.vectorstore = self._new_vectorstore(xb)
+                self._mapped_name = None
+                self._add_vectors(xb, documents)
+                self._set_nprobe()
             st.success(f"Created vector store with {len(documents)} documents")
             return self.vectorstore
             
@@ -45,7 +163,10 @@ class VectorStoreManager:
         
         try:
             with st.spinner("Adding documents to vector store..."):
-                self.vectorstore.add_documents(documents)
+                if self._mapped_name is not None:
+                    # Memory-mapped indexes are read-only, pull the index into RAM before mutating it
+                    self.load_vectorstore(self._mapped_name, show_messages=False, mmap=False)
+                self._add_vectors(self._embed_documents(documents), documents)
             st.success(f"Added {len(documents)} documents to vector store")
             
         except Exception as e:
@@ -59,14 +180,34 @@ class VectorStoreManager:
         
         try:
             save_path = os.path.join(self.persist_directory, name)
-            self.vectorstore.save_local(save_path)
+            self.vectorstore.save_local(self.persist_directory, index_name=name)
             st.success(f"Vector store saved to {save_path}")
             
         except Exception as e:
             st.error(f"Error saving vector store: {str(e)}")
             raise e
     
-    def load_vectorstore(self, name: str = "faiss_index", show_messages: bool = True) -> Optional[FAISS]:
+    def _load_faiss_mmap(self, name: str) -> FAISS:
+        load_path = os.path.join(self.persist_directory, name)
+        index = faiss.read_index(f"{load_path}.faiss", faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        with open(f"{load_path}.pkl", "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
+    
+    def load_vectorstore(
+        self,
+        name: str = "faiss_index",
+        show_messages: bool = True,
+        mmap: Optional[bool] = None
+    ) -> Optional[Union[FAISS, BinaryFAISS]]:
+        mmap = self.mmap if mmap is None else mmap
         try:
             load_path = os.path.join(self.persist_directory, name)
             
@@ -76,11 +217,25 @@ class VectorStoreManager:
                 return None
             
             with st.spinner("Loading vector store..."):
-                self.vectorstore = FAISS.load_local(
-                    load_path,
-                    self.embeddings,
-                    allow_dangerous_deserialization=True
-                )
+                if self.quantization == "binary":
+                    self.vectorstore = BinaryFAISS.load_local(
+                        self.persist_directory,
+                        self.embeddings,
+                        index_name=name,
+                        mmap=mmap
+                    )
+                elif mmap:
+                    self.vectorstore = self._load_faiss_mmap(name)
+                else:
+                    self.vectorstore = FAISS.load_local(
+                        self.persist_directory,
+                        self.embeddings,
+                        index_name=name,
+                        allow_dangerous_deserialization=True,
+                        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+                    )
+                self._mapped_name = name if mmap else None
+                self._set_nprobe()
             if show_messages:
                 st.success("Vector store loaded successfully")
             return self.vectorstore
@@ -95,6 +250,7 @@ class VectorStoreManager:
         if self.vectorstore is None:
             raise ValueError("No vector store available. Please create or load one first.")
         
+        self._set_nprobe()
         return self.vectorstore.as_retriever(
             search_type=search_type,
             search_kwargs={"k": k, **kwargs}
@@ -109,10 +265,23 @@ class VectorStoreManager:
     
     def reset_vectorstore(self) -> None:
         self.vectorstore = None
+        self._mapped_name = None
+        # Drop the old index's buffers now rather than whenever the cycle collector runs
+        gc.collect()
         st.info("Vector store reset")
 
 
 @st.cache_resource
-def get_vectorstore_manager(_embeddings: HuggingFaceEmbeddings, persist_directory: str = "vectorstore") -> VectorStoreManager:
+def get_vectorstore_manager(
+    _embeddings: HuggingFaceEmbeddings,
+    persist_directory: str = "vectorstore",
+    quantization: str = "pq",
+    _embedding_manager: Optional[EmbeddingManager] = None
+) -> VectorStoreManager:
     
-    return VectorStoreManager(embeddings=_embeddings, persist_directory=persist_directory)
+    return VectorStoreManager(
+        embeddings=_embeddings,
+        persist_directory=persist_directory,
+        quantization=quantization,
+        embedding_manager=_embedding_manager
+    )